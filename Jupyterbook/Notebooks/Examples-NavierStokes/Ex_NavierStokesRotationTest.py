@@ -29,6 +29,10 @@ from underworld3.systems import NavierStokesSLCN
 from underworld3 import function
 
 
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import sympy
 
@@ -43,6 +47,20 @@ maxsteps = uw.options.getInt("max_steps", default=25)
 restart_step = uw.options.getInt("restart_step", default=-1)
 rho = uw.options.getReal("rho", default=1000)
 
+# velocity-block multigrid settings (-tune_mg times every combination)
+mg_type = uw.options.getString("velocity_mg_type", default="kaskade")
+mg_cycle_type = uw.options.getString("velocity_mg_cycle_type", default="w")
+mg_levels_its = uw.options.getInt("velocity_mg_levels_its", default=2)
+mg_coarse_pc_type = uw.options.getString("velocity_mg_coarse_pc_type", default="svd")
+tune_mg = uw.options.getBool("tune_mg", default=False)
+
+# print the SNES / KSP residuals for every solve (-show_monitors=0 to
+# turn off and write the timestep messages in blocks)
+show_monitors = uw.options.getBool("show_monitors", default=True)
+
+# size (in pixels) of the square timestep screenshots
+plot_pixels = uw.options.getInt("plot_pixels", default=1024)
+
 outdir="output"
 
 if uw.mpi.rank == 0:
@@ -59,26 +77,17 @@ meshball.view()
 # +
 # Define some functions on the mesh
 
-import sympy
-
-radius_fn = sympy.sqrt(
-    meshball.rvec.dot(meshball.rvec)
-)  # normalise by outer radius if not 1.0
-unit_rvec = meshball.rvec / (1.0e-10 + radius_fn)
-
 # Some useful coordinate stuff
 
 x = meshball.N.x
 y = meshball.N.y
 
-r = sympy.sqrt(x**2 + y**2)
-th = sympy.atan2(y + 1.0e-5, x + 1.0e-5)
-
 # Rigid body rotation v_theta = constant, v_r = 0.0
+# (r sin(theta) = y and r cos(theta) = x, so no trig is needed)
 
 theta_dot = 2.0 * np.pi  # i.e one revolution in time 1.0
-v_x = -1.0 * r * theta_dot * sympy.sin(th) * y # to make a convergent / divergent bc
-v_y = r * theta_dot * sympy.cos(th) * y
+v_x = -1.0 * theta_dot * y * y # to make a convergent / divergent bc
+v_y = theta_dot * x * y
 # -
 
 v_soln = uw.discretisation.MeshVariable("U", meshball, meshball.dim, degree=2)
@@ -97,20 +106,29 @@ navier_stokes = uw.systems.NavierStokes(
 )
 
 # +
-navier_stokes.petsc_options["snes_monitor"] = None
-navier_stokes.petsc_options["ksp_monitor"] = None
+if show_monitors:
+    navier_stokes.petsc_options["snes_monitor"] = None
+    navier_stokes.petsc_options["ksp_monitor"] = None
 
 navier_stokes.petsc_options["snes_type"] = "newtonls"
 navier_stokes.petsc_options["ksp_type"] = "fgmres"
 
+# Rebuild the Jacobian every 3rd Newton iteration and the preconditioner
+# every 6th (PETSc only checks the preconditioner lag when the Jacobian is
+# rebuilt, so it should be a multiple of the Jacobian lag). The lag does
+# not persist between solves, so each timestep (and any change in dt)
+# starts from a freshly assembled Jacobian.
+navier_stokes.petsc_options["snes_lag_jacobian"] = 3
+navier_stokes.petsc_options["snes_lag_preconditioner"] = 6
+
 navier_stokes.petsc_options.setValue("fieldsplit_velocity_pc_type", "mg")
-navier_stokes.petsc_options.setValue("fieldsplit_velocity_pc_mg_type", "kaskade")
-navier_stokes.petsc_options.setValue("fieldsplit_velocity_pc_mg_cycle_type", "w")
+navier_stokes.petsc_options.setValue("fieldsplit_velocity_pc_mg_type", mg_type)
+navier_stokes.petsc_options.setValue("fieldsplit_velocity_pc_mg_cycle_type", mg_cycle_type)
 
-navier_stokes.petsc_options["fieldsplit_velocity_mg_coarse_pc_type"] = "svd"
+navier_stokes.petsc_options["fieldsplit_velocity_mg_coarse_pc_type"] = mg_coarse_pc_type
 navier_stokes.petsc_options["fieldsplit_velocity_ksp_type"] = "fcg"
 navier_stokes.petsc_options["fieldsplit_velocity_mg_levels_ksp_type"] = "chebyshev"
-navier_stokes.petsc_options["fieldsplit_velocity_mg_levels_ksp_max_it"] = 2
+navier_stokes.petsc_options["fieldsplit_velocity_mg_levels_ksp_max_it"] = mg_levels_its
 navier_stokes.petsc_options["fieldsplit_velocity_mg_levels_ksp_converged_maxits"] = None
 
 # mg, multiplicative - very robust ... similar to gamg, additive
@@ -121,6 +139,8 @@ navier_stokes.petsc_options.setValue("fieldsplit_pressure_pc_mg_cycle_type", "v"
 # -
 
 
+# The solver JIT-compiles the curl into a PETSc pointwise function at setup
+
 nodal_vorticity_from_v = uw.systems.Projection(meshball, vorticity)
 nodal_vorticity_from_v.uw_function = meshball.vector.curl(v_soln.sym)
 nodal_vorticity_from_v.smoothing = 0.0
@@ -167,6 +187,9 @@ navier_stokes.bodyforce = sympy.Matrix([0, 0])
 # navier_stokes.add_natural_bc( (vbc_xn, vbc_yn), "Upper")
 # navier_stokes.add_natural_bc( (vbc_xn, vbc_yn), "Lower")
 
+# The solver JIT-compiles the sympy BC expressions into PETSc pointwise
+# functions at setup
+
 navier_stokes.add_dirichlet_bc((v_x, v_y), "Upper")
 # navier_stokes.add_dirichlet_bc((0.0, 0.0), "Lower")
 
@@ -174,6 +197,99 @@ expt_name = f"Cylinder_NS_rho_{navier_stokes.rho}_{resolution}"
 
 # -
 
+# +
+# Tuning run (-tune_mg): time one timestep solve for each combination of
+# the velocity multigrid settings, report the fastest converged one and
+# stop. This cell comes before the notebook halt below so that it can
+# be run as a script.
+
+if tune_mg:
+    import itertools
+    import time
+    from mpi4py import MPI
+    from petsc4py import PETSc
+
+    navier_stokes.delta_t_physical = 0.1
+    navier_stokes.solve(timestep=0.1, verbose=False, evalf=True, order=1)
+
+    # every combination starts from the same state: the current solution
+    # and the history terms of the time derivatives
+
+    tune_vars = [v_soln, p_soln]
+    tune_vars += list(navier_stokes.DuDt.psi_star) + list(navier_stokes.DFDt.psi_star)
+
+    with meshball.access():
+        tune_state = [var.data.copy() for var in tune_vars]
+
+    def restore_tune_state():
+        with meshball.access(*tune_vars):
+            for var, data in zip(tune_vars, tune_state):
+                var.data[...] = data
+
+    tuning = []
+
+    for mg_type, mg_cycle_type, mg_levels_its, mg_coarse_pc_type in itertools.product(
+        ["multiplicative", "kaskade", "additive"],
+        ["v", "w"],
+        [1, 2, 3],
+        ["svd", "lu", "redundant"],
+    ):
+        navier_stokes.petsc_options.setValue("fieldsplit_velocity_pc_mg_type", mg_type)
+        navier_stokes.petsc_options.setValue("fieldsplit_velocity_pc_mg_cycle_type", mg_cycle_type)
+        navier_stokes.petsc_options["fieldsplit_velocity_mg_levels_ksp_max_it"] = mg_levels_its
+        navier_stokes.petsc_options["fieldsplit_velocity_mg_coarse_pc_type"] = mg_coarse_pc_type
+
+        # rebuild the solver so that the new options are picked up (untimed)
+        navier_stokes.is_setup = False
+        restore_tune_state()
+        navier_stokes.solve(timestep=0.1, zero_init_guess=False, evalf=True)
+
+        restore_tune_state()
+
+        # the same call as the time loop below
+        stage = PETSc.Log.Stage(
+            f"tune_mg_{mg_type}_{mg_cycle_type}_{mg_levels_its}_{mg_coarse_pc_type}"
+        )
+        stage.push()
+        start = time.perf_counter()
+        navier_stokes.solve(timestep=0.1, zero_init_guess=False, evalf=True)
+        elapsed = time.perf_counter() - start
+        stage.pop()
+
+        elapsed = uw.mpi.comm.allreduce(elapsed, op=MPI.MAX)
+
+        tuning.append(
+            (
+                elapsed,
+                navier_stokes.snes.getConvergedReason() > 0,
+                navier_stokes.snes.getIterationNumber(),
+                navier_stokes.snes.getLinearSolveIterations(),
+                mg_type,
+                mg_cycle_type,
+                mg_levels_its,
+                mg_coarse_pc_type,
+            )
+        )
+
+    if uw.mpi.rank == 0:
+        print("solve time  converged  snes_its  ksp_its  mg_type  cycle  levels_its  coarse_pc")
+        for row in sorted(tuning):
+            print("{:10.3f}  {}  {}  {}  {}  {}  {}  {}".format(*row))
+
+        converged = [row for row in tuning if row[1]]
+
+        if converged:
+            best = min(converged)
+            print(
+                f"Fastest: -velocity_mg_type={best[4]} -velocity_mg_cycle_type={best[5]} "
+                f"-velocity_mg_levels_its={best[6]} -velocity_mg_coarse_pc_type={best[7]}",
+                flush=True,
+            )
+        else:
+            print("No combination converged", flush=True)
+
+    sys.exit(0)
+
 
 navier_stokes.DuDt.bdf(1) 
 
@@ -204,24 +320,25 @@ if restart_step > 0:
     
     # Flux history variable might be a good idea
 # +
-nodal_vorticity_from_v.solve()
+# The mesh does not change, so the pyvista objects are built once here
+# and plots only refresh their point data
 
-# check the mesh if in a notebook / serial
 if uw.mpi.size == 1:
     import pyvista as pv
     import underworld3.visualisation as vis
 
-    pvmesh = vis.mesh_to_pv_mesh(meshball)
-    pvmesh.point_data["Omega"] = vis.scalar_fn_to_pv_points(pvmesh, vorticity.sym)
-    pvmesh.point_data["V"] = vis.vector_fn_to_pv_points(pvmesh, v_soln.sym)
+    pv.global_theme.multi_samples = 1
 
+    pvmesh = vis.mesh_to_pv_mesh(meshball)
     velocity_points = vis.meshVariable_to_pv_cloud(v_soln)
-    velocity_points.point_data["V"] = vis.vector_fn_to_pv_points(
-        velocity_points, v_soln.sym
-    )
-
-    passive_swarm_points = uw.visualisation.swarm_to_pv_cloud(passive_swarm)
 
+    # outline of the annulus (boundary curves only, no interior cells)
+    pvmesh_edges = pvmesh.extract_feature_edges(
+        boundary_edges=True,
+        feature_edges=False,
+        manifold_edges=False,
+        non_manifold_edges=False,
+    )
 
     # point sources at cell centres
     points = np.zeros((meshball._centroids.shape[0], 3))
@@ -229,6 +346,26 @@ if uw.mpi.size == 1:
     points[:, 1] = meshball._centroids[:, 1]
     centroid_cloud = pv.PolyData(points)
 
+    # Screenshots are rendered in the main thread but PNG encoding is handed
+    # to a background thread so the next solve does not wait for it. At most
+    # two images are in flight at any time.
+    png_writer = ThreadPoolExecutor(max_workers=1)
+    png_pending = deque()
+
+# +
+nodal_vorticity_from_v.solve()
+
+# check the mesh if in a notebook / serial
+if uw.mpi.size == 1:
+    pvmesh.point_data["Omega"] = vis.scalar_fn_to_pv_points(pvmesh, vorticity.sym)
+    pvmesh.point_data["V"] = vis.vector_fn_to_pv_points(pvmesh, v_soln.sym)
+
+    velocity_points.point_data["V"] = vis.vector_fn_to_pv_points(
+        velocity_points, v_soln.sym
+    )
+
+    passive_swarm_points = uw.visualisation.swarm_to_pv_cloud(passive_swarm)
+
     pvstream = pvmesh.streamlines_from_source(
         centroid_cloud,
         vectors="V",
@@ -267,29 +404,28 @@ if uw.mpi.size == 1:
     pl.show(jupyter_backend="client")
 
 
+def save_png(image, filename):
+    from PIL import Image
+
+    while len(png_pending) >= 2:
+        png_pending.popleft().result()
+
+    png_pending.append(png_writer.submit(Image.fromarray(image).save, filename))
+
+
 def plot_V_mesh(filename):
     if uw.mpi.size == 1:
-        import pyvista as pv
-        import underworld3.visualisation as vis
-
-        pvmesh = vis.mesh_to_pv_mesh(meshball)
+        # pvmesh, velocity_points and centroid_cloud are built once (above)
         pvmesh.point_data["P"] = vis.scalar_fn_to_pv_points(pvmesh, p_soln.sym)
         pvmesh.point_data["Omega"] = vis.scalar_fn_to_pv_points(pvmesh, vorticity.sym)
         pvmesh.point_data["V"] = vis.vector_fn_to_pv_points(pvmesh, v_soln.sym)
 
-        velocity_points = vis.meshVariable_to_pv_cloud(v_soln)
         velocity_points.point_data["V"] = vis.vector_fn_to_pv_points(
             velocity_points, v_soln.sym
         )
 
         passive_swarm_points = uw.visualisation.swarm_to_pv_cloud(passive_swarm)
 
-        # point sources at cell centres
-        points = np.zeros((meshball._centroids.shape[0], 3))
-        points[:, 0] = meshball._centroids[:, 0]
-        points[:, 1] = meshball._centroids[:, 1]
-        centroid_cloud = pv.PolyData(points)
-
         pvstream = pvmesh.streamlines_from_source(
             centroid_cloud,
             vectors="V",
@@ -299,6 +435,7 @@ def plot_V_mesh(filename):
         )
 
         pl = pv.Plotter()
+        pl.enable_anti_aliasing("fxaa")
 
         pl.add_arrows(
             velocity_points.points,
@@ -326,12 +463,7 @@ def plot_V_mesh(filename):
             opacity=0.5,
         )
 
-        pl.add_mesh(
-            pvmesh,
-            cmap="RdBu",
-            scalars="Omega",
-            opacity=0.1,  # clim=[0.0, 20.0]
-        )
+        pl.add_mesh(pvmesh_edges, color="Black", opacity=0.75)
 
         pl.add_mesh(pvstream, opacity=0.33)
 
@@ -340,12 +472,13 @@ def plot_V_mesh(filename):
         for scalar in scale_bar_items:
             pl.remove_scalar_bar(scalar)
 
-        pl.screenshot(
-            filename="{}.png".format(filename),
-            window_size=(2560, 2560),
-            return_img=False,
+        image = pl.screenshot(
+            window_size=(plot_pixels, plot_pixels),
+            return_img=True,
         )
 
+        save_png(image, "{}.png".format(filename))
+
         # pl.show()
 
 
@@ -362,20 +495,39 @@ navier_stokes.delta_t_physical = 0.1
 
 delta_t = 0.1 #  5.0 * navier_stokes.estimate_dt()
 
+# progress messages are collected and written out at each output step
+# (or every step when the solver monitors are on, so that each line stays
+# next to the residuals it belongs to)
+timestep_log = []
+
+
+def flush_timestep_log():
+    if uw.mpi.rank == 0 and timestep_log:
+        sys.stdout.write("\n".join(timestep_log) + "\n")
+        sys.stdout.flush()
+        timestep_log.clear()
+
+
 for step in range(0, maxsteps+1):  # 250
     
     # if step%10 == 0:
     #     delta_t = 5.0 * navier_stokes.estimate_dt()
 
     navier_stokes.solve(timestep=delta_t, zero_init_guess=False, evalf=True)    
-    passive_swarm.advection(v_soln.sym, delta_t, order=2, corrector=False, evalf=False)
 
-    nodal_vorticity_from_v.solve()
+    # advection evaluates v_soln at all particles in one call; evalf=False
+    # uses the mesh-variable interpolation rather than the RBF approximation
+    passive_swarm.advection(v_soln.sym, delta_t, order=2, corrector=False, evalf=False)
 
     if uw.mpi.rank == 0:
-        print("Timestep {}, dt {}".format(ts, delta_t), flush=True)
+        timestep_log.append("Timestep {}, dt {}".format(ts, delta_t))
+
+    if show_monitors or ts % 5 == 0:
+        flush_timestep_log()
 
     if ts % 5 == 0:
+        # vorticity is only used for plots / checkpoints
+        nodal_vorticity_from_v.solve()
         plot_V_mesh(filename=f"{outdir}/{expt_name}_step_{ts}")
         
         meshball.write_timestep(
@@ -396,6 +548,15 @@ for step in range(0, maxsteps+1):  # 250
         )
 
     ts += 1
+
+flush_timestep_log()
+
+# wait for any screenshots still being written (raises any write errors)
+if uw.mpi.size == 1:
+    while png_pending:
+        png_pending.popleft().result()
+
+    png_writer.shutdown(wait=True)
 # -
 
 
@@ -267,13 +267,14 @@ passive_swarm.populate(
 )
 
 # add new points at the inflow
+rng = np.random.default_rng(seed=42 + uw.mpi.rank)
+
 npoints = 50
 passive_swarm.dm.addNPoints(npoints)
 with passive_swarm.access(passive_swarm.particle_coordinates):
-    for i in range(npoints):
-        passive_swarm.particle_coordinates.data[-1 : -(npoints + 1) : -1, :] = np.array(
-            [0.0, 0.195] + 0.01 * np.random.random((npoints, 2))
-        )
+    passive_swarm.particle_coordinates.data[-npoints:, :] = np.array(
+        [0.0, 0.195]
+    ) + 0.01 * rng.random((npoints, 2))
 
 # -
 nodal_vorticity_from_v = uw.systems.Projection(pipemesh, vorticity)
@@ -521,10 +522,19 @@ navier_stokes.DuDt.update(delta_t)
 # -
 
 
+# new points added at the inflow each step, drawn in one block
+# for reseed_block steps at a time
+npoints = 200
+reseed_block = 100
+reseed_centre = np.array([0.0, 0.195])
+reseed_pool = np.empty((reseed_block, npoints, 2))
+
 for step in range(0, 251): #1500
-    delta_t_cfl = 5 * navier_stokes.estimate_dt()
 
+    # the CFL estimate (a global reduction) is only needed when delta_t
+    # is updated, every 10 steps
     if step % 10 == 0:
+        delta_t_cfl = 5 * navier_stokes.estimate_dt()
         delta_t = min(delta_t_cfl, dt_ns)
 
     navier_stokes.solve(timestep=dt_ns, zero_init_guess=False)
@@ -536,17 +546,22 @@ for step in range(0, 251): #1500
     swarm.advection(v_soln.sym, delta_t, order=2, corrector=False, evalf=False)
 
     
-    # add new points at the inflow
-    npoints = 200
+    # add new points at the inflow (points carried out of the pipe are
+    # dropped when the swarm migrates during advection)
+    if step % reseed_block == 0:
+        rng.random(out=reseed_pool)
+        reseed_pool *= 0.01
+        reseed_pool += reseed_centre
+
     passive_swarm.dm.addNPoints(npoints)
     with passive_swarm.access(passive_swarm.particle_coordinates):
-        for i in range(npoints):
-            passive_swarm.particle_coordinates.data[
-                -1 : -(npoints + 1) : -1, :
-            ] = np.array([0.0, 0.195] + 0.01 * np.random.random((npoints, 2)))
+        passive_swarm.particle_coordinates.data[-npoints:, :] = reseed_pool[step % reseed_block]
 
     if uw.mpi.rank == 0:
-        print("Timestep {}, t {}, dt {}, dt_s {}".format(ts, elapsed_time, delta_t, delta_t_cfl))
+        if step % 10 == 0:
+            print("Timestep {}, t {}, dt {}, dt_s {}".format(ts, elapsed_time, delta_t, delta_t_cfl))
+        else:
+            print("Timestep {}, t {}, dt {}".format(ts, elapsed_time, delta_t))
 
     if ts % 10 == 0:
         nodal_vorticity_from_v.solve()
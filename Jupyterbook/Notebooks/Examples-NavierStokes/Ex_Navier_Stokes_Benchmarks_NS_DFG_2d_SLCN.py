@@ -241,13 +241,14 @@ passive_swarm.populate(
 )
 
 # add new points at the inflow
+rng = np.random.default_rng(seed=42 + uw.mpi.rank)
+
 npoints = 100
 passive_swarm.dm.addNPoints(npoints)
 with passive_swarm.access(passive_swarm.particle_coordinates):
-    for i in range(npoints):
-        passive_swarm.particle_coordinates.data[-1 : -(npoints + 1) : -1, :] = np.array(
-            [0.01, 0.195] + 0.01 * np.random.random((npoints, 2))
-        )
+    passive_swarm.particle_coordinates.data[-npoints:, :] = np.array(
+        [0.01, 0.195]
+    ) + 0.01 * rng.random((npoints, 2))
 
 # -
 nodal_vorticity_from_v = uw.systems.Projection(pipemesh, vorticity)
@@ -447,6 +448,13 @@ print(f"Dt_adv -> {delta_t_adv}; Dt_diff -> {delta_t_diff}")
 
 print(delta_t / delta_t_adv)
 
+# new points added at the inflow each step, drawn in one block
+# for reseed_block steps at a time
+npoints = 200
+reseed_block = 100
+reseed_centre = np.array([0.0, 0.195])
+reseed_pool = np.empty((reseed_block, npoints, 2))
+
 for step in range(0, maxsteps): #1500
 
     navier_stokes.solve(timestep=delta_t, zero_init_guess=False, verbose=False)
@@ -454,14 +462,16 @@ for step in range(0, maxsteps): #1500
     # update passive swarm
     passive_swarm.advection(v_soln.sym, delta_t, order=2, corrector=False, evalf=False)
 
-    # add new points at the inflow
-    npoints = 200
+    # add new points at the inflow (points carried out of the pipe are
+    # dropped when the swarm migrates during advection)
+    if step % reseed_block == 0:
+        rng.random(out=reseed_pool)
+        reseed_pool *= 0.01
+        reseed_pool += reseed_centre
+
     passive_swarm.dm.addNPoints(npoints)
     with passive_swarm.access(passive_swarm.particle_coordinates):
-        for i in range(npoints):
-            passive_swarm.particle_coordinates.data[
-                -1 : -(npoints + 1) : -1, :
-            ] = np.array([0.0, 0.195] + 0.01 * np.random.random((npoints, 2)))
+        passive_swarm.particle_coordinates.data[-npoints:, :] = reseed_pool[step % reseed_block]
 
     if uw.mpi.rank == 0:
         print("Timestep {}, t {}, dt {}".format(ts, elapsed_time, delta_t))